@@ -1,11 +1,12 @@
 #!/bin/bash
 
+# Requires Python >= 3.8 and GDAL >= 3.3 (Ubuntu 22.04 or newer)
+
 sudo apt-get update
 
 sudo apt-get install -y --no-install-recommends \
 	build-essential \
 	gdal-bin \
-	python-dev \
 	python3-dev \
-	python-gdal \
+	python3-gdal \
 	python3-pip
@@ -1,17 +1,48 @@
 #!/usr/bin/python3
 
 import os
+import re
+import glob
+import shutil
 import shelve
 import subprocess
-from re import findall
+import http.client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from zipfile import ZipFile
-from urllib.request import urlopen, HTTPError, URLError
+from urllib.request import urlopen, Request, HTTPError, URLError
 from datetime import datetime as dt
 
+from osgeo import gdal
+import osgeo_utils.gdal2tiles as g2t
+
 FAA_VFR_CHARTS_URL = 'https://www.faa.gov/air_traffic/flight_info/aeronav/digital_products/vfr/'
+SECTIONAL_URL_PATTERN = re.compile(rb'="?(https?\:\/\/aeronav\.faa\.gov\/visual\/(\d{2}-\d{2}-\d{4})\/sectional-files\/([a-zA-Z_\-]+)\.zip)"?>')
+# Seconds a connection may sit idle before a chart download is abandoned
+DOWNLOAD_TIMEOUT = 60
 MIN_ZOOM = 0
 MAX_ZOOM = 2
-
+RESAMPLING = 'lanczos'
+# Opt-in tiling speedup: read only one tile's worth of pixels per base tile. This skips resampling,
+# so base tiles become nearest-neighbour and alias badly when the charts are heavily downsampled.
+FAST_BASE_TILES = False
+
+# Tiled, compressed GeoTIFFs are much smaller and quicker for the next stage to read back
+GTIFF_CREATION_OPTIONS = [
+	'-co', 'TILED=YES',
+	'-co', 'COMPRESS=LZW',
+	'-co', 'PREDICTOR=2',
+	'-co', 'BLOCKXSIZE=512',
+	'-co', 'BLOCKYSIZE=512'
+]
+
+CPU_COUNT = os.cpu_count() or 1
+
+try:
+	TOTAL_MEMORY_MB = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+except (ValueError, OSError, AttributeError):
+	TOTAL_MEMORY_MB = 4096
+
+# Working directories keep a trailing '/' so chart paths can be built by plain concatenation
 current_directory = os.path.dirname(__file__)
 base_directory = os.path.abspath(os.path.join(current_directory, '..'))
 tiles_directory = os.path.join(base_directory, 'tiles/')
@@ -21,291 +52,360 @@ clipping_shapes_directory = os.path.join(assets_directory, 'clipping_shapes/')
 tilers_tools_directory = os.path.join(current_directory, 'tilers_tools')
 raw_charts_directory = os.path.join(tmp_directory, '01_raw/')
 colored_charts_directory = os.path.join(tmp_directory, '02_rgba/')
-cropped_charts_directory = os.path.join(tmp_directory, '03_cropped/')
 warped_charts_directory = os.path.join(tmp_directory, '04_warped/')
 intermediate_tiles_directory = os.path.join(tmp_directory, '05_intermediate_tiles')
 sectional_version_index_file = os.path.join(tmp_directory, 'version_index')
 vrt_file = os.path.join(tmp_directory, 'merged_sectionals.vrt')
 
 
-def run_command(command, print_output=False):
-	if print_output:
-			proc = subprocess.Popen(command, shell=True)
-	else:
-		proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-	
-	proc.communicate()
-
-
-def create_directories():
-	if not os.path.exists(tiles_directory):
-		os.makedirs(tiles_directory)
+def run_command(argv, print_output=False):
+	proc = subprocess.run(
+		argv,
+		stdout=None if print_output else subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+		check=False
+	)
 
-	if not os.path.exists(tmp_directory):
-		os.makedirs(tmp_directory)
+	if proc.returncode != 0:
+		print(argv[0] + ' failed: ' + proc.stderr.decode(errors='replace'))
 
-	if not os.path.exists(raw_charts_directory):
-		os.makedirs(raw_charts_directory)
+	return proc
 
-	if not os.path.exists(colored_charts_directory):
-		os.makedirs(colored_charts_directory)
 
-	if not os.path.exists(cropped_charts_directory):
-		os.makedirs(cropped_charts_directory)
+def silentremove(path):
+	try:
+		os.remove(path)
+	except FileNotFoundError:
+		pass
 
-	if not os.path.exists(warped_charts_directory):
-		os.makedirs(warped_charts_directory)
 
-	if not os.path.exists(intermediate_tiles_directory):
-		os.makedirs(intermediate_tiles_directory)
+def create_directories():
+	for directory in (tiles_directory, tmp_directory, raw_charts_directory, colored_charts_directory,
+	                  warped_charts_directory, intermediate_tiles_directory):
+		os.makedirs(directory, exist_ok=True)
 
 
-def get_local_sectional_version(location):
-	with shelve.open(sectional_version_index_file) as shelf:
-		try:
-			return shelf[location]
-		except KeyError:
-			return "01-01-1900"
+def get_local_sectional_version(shelf, location):
+	try:
+		return shelf[location]
+	except KeyError:
+		return "01-01-1900"
 
 
-def set_local_sectional_version(location, version):
-	with shelve.open(sectional_version_index_file) as shelf:
-		shelf[location] = version
+def set_local_sectional_version(shelf, location, version):
+	shelf[location] = version
+	# Flush straight away so a halted run doesn't lose track of what was downloaded
+	shelf.sync()
 
 
 def download_chart(sectional_info):
+	zip_path = raw_charts_directory + sectional_info['location'] + '.zip'
 	try:
-		with open(os.path.join(raw_charts_directory, sectional_info['location'] + '.zip'), 'wb') as zip_file:
-			web_response = urlopen(sectional_info['url'])
-			zip_file.write(web_response.read())
+		with open(zip_path, 'wb') as zip_file:
+			# The archives are already compressed, so ask for them as-is
+			request = Request(sectional_info['url'], headers={'Accept-Encoding': 'identity'})
+			with urlopen(request, timeout=DOWNLOAD_TIMEOUT) as web_response:
+				shutil.copyfileobj(web_response, zip_file, length=1024 * 1024)
+		return True
 
 	except HTTPError as e:
-		print('HTTP Error:' + e.code + sectional_info['url'])
+		print('HTTP Error:' + str(e.code) + sectional_info['url'])
 	except URLError as e:
-		print('URL Error:' + e.reason + sectional_info['url'])
+		print('URL Error:' + str(e.reason) + sectional_info['url'])
+	except (OSError, http.client.HTTPException) as e:
+		# Connection resets, timeouts and truncated transfers mid-download
+		print('Download Error:' + repr(e) + sectional_info['url'])
+
+	# Don't leave an empty or partial archive behind
+	silentremove(zip_path)
+	return False
 
 
 def unzip_archive(archive_path, tif_name):
-	previous_list = os.listdir(raw_charts_directory)
-	
-	if archive_path.endswith('.zip'):
-		zip_ref = ZipFile(os.path.join(raw_charts_directory, archive_path), 'r')
-		zip_ref.extractall(raw_charts_directory)
-		zip_ref.close()
-		os.remove(archive_path)
-	
-	new_files = [i for i in list(os.listdir(raw_charts_directory)) if i not in previous_list]
-
-	for filename in new_files:
-		if filename.endswith('.tif'):
-			os.rename(
-				os.path.join(raw_charts_directory, filename),
-				os.path.join(raw_charts_directory, tif_name)
-			)
+	# Only the chart itself is needed, so copy the tif straight out and skip the sidecar files
+	with ZipFile(archive_path, 'r') as zip_ref:
+		tif_name_in_zip = next((name for name in zip_ref.namelist() if name.lower().endswith('.tif')), None)
+
+		if tif_name_in_zip is None:
+			print('No chart found in ' + archive_path)
 		else:
-			os.remove(
-				os.path.join(raw_charts_directory, filename)
-			)
+			with zip_ref.open(tif_name_in_zip) as src, open(raw_charts_directory + tif_name, 'wb') as dst:
+				shutil.copyfileobj(src, dst, 1024 * 1024)
+
+	os.remove(archive_path)
 
 
 def download_sectional_charts():
 	print('Downloading new/updated sectional charts...')
-	download_queue = list()
-	web_response = urlopen(FAA_VFR_CHARTS_URL)
-	web_content = str(web_response.read())
-
-	# Find all the sectionals
-	matches = findall(r'="?(https?\:\/\/aeronav\.faa\.gov\/visual\/(\d{2}-\d{2}-\d{4})\/sectional-files\/([a-zA-Z_\-]+)\.zip)"?>', web_content)
-
-	# Iterate over the matches
-	for url, version, location in matches:
-		sectional_info = {
-			'url': str(url),
-			'location': str(location),
-			'version': str(version)
-		}
-
-		online_version_date = dt.strptime(sectional_info['version'], "%m-%d-%Y")
-		local_version_date = dt.strptime(get_local_sectional_version(sectional_info['location']), "%m-%d-%Y")
-
-		# Only add to the queue if it's not already downloaded OR if the online file is more recent
-		if sectional_info['location'] + '.tif' not in os.listdir(raw_charts_directory) or \
-		            local_version_date < online_version_date:
-			for item in download_queue:
-				if item['location'] == sectional_info['location'] and item['version'] < sectional_info['version']:
-					item['url'] = sectional_info['url']
-					item['version'] = sectional_info['version']
-					break
-			else:
+	with shelve.open(sectional_version_index_file) as shelf:
+		# Match against the raw bytes; only the captured groups need decoding
+		with urlopen(FAA_VFR_CHARTS_URL) as web_response:
+			web_content = web_response.read()
+
+		# Keep only the newest online version of each sectional, as the page can link the same one several times
+		newest_sectionals = dict()
+		for match in SECTIONAL_URL_PATTERN.finditer(web_content):
+			url, version, location = match.groups()
+			sectional_info = {
+				'url': url.decode('ascii'),
+				'location': location.decode('ascii'),
+				'version': version.decode('ascii'),
+				'date': dt.strptime(version.decode('ascii'), "%m-%d-%Y")
+			}
+
+			current = newest_sectionals.get(sectional_info['location'])
+			if current is None or current['date'] < sectional_info['date']:
+				newest_sectionals[sectional_info['location']] = sectional_info
+
+		# List the raw charts once up front rather than once per sectional
+		with os.scandir(raw_charts_directory) as entries:
+			existing_tifs = {entry.name for entry in entries if entry.name.endswith('.tif')}
+
+		download_queue = list()
+		for sectional_info in newest_sectionals.values():
+			local_version_date = dt.strptime(get_local_sectional_version(shelf, sectional_info['location']), "%m-%d-%Y")
+
+			# Only add to the queue if it's not already downloaded OR if the online file is more recent
+			if sectional_info['location'] + '.tif' not in existing_tifs or \
+			            local_version_date < sectional_info['date']:
 				download_queue.append(sectional_info)
 
-	# Iterate over each item in the download queue. The files in this queue are only the ones which are newer or simply missing
-	for sectional_info in download_queue:
-		print("Download: " + sectional_info['location'] + ", Version date: " + sectional_info['version'])
+		# Iterate over each item in the download queue. The files in this queue are only the ones which are newer or simply missing
+		for sectional_info in download_queue:
+			print("Download: " + sectional_info['location'] + ", Version date: " + sectional_info['version'])
+
+			# Remove TIFF files in processing directories. This is a fundamental part in the  mechanism to resume procssing after a halted run.
+			silentremove(raw_charts_directory + sectional_info['location'] + '.tif')
+			silentremove(colored_charts_directory + sectional_info['location'] + '.tif')
+			silentremove(warped_charts_directory + sectional_info['location'] + '.tif')
+
+		# Download the individual charts concurrently
+		with ThreadPoolExecutor(max_workers=8) as ex:
+			downloaded = list(ex.map(download_chart, download_queue))
+
+		# Only charts that actually downloaded are recorded; the rest are retried on the next run
+		for sectional_info, success in zip(download_queue, downloaded):
+			if not success:
+				continue
+
+			# Write the sectional information to the index file
+			set_local_sectional_version(shelf, sectional_info['location'], sectional_info['version'])
+
+			# Unzip the sectional and delete the original zip file
+			unzip_archive(raw_charts_directory + sectional_info['location'] + '.zip', sectional_info['location'] + '.tif')
+
+
+def chart_entries(directory):
+	# Chart tifs in a stage directory, skipping any in-progress tmp files
+	with os.scandir(directory) as entries:
+		return [entry for entry in entries
+		        if entry.is_file() and entry.name.endswith('.tif') and not entry.name.startswith('tmp_')]
+
+
+def _up_to_date(src_entry, dst):
+	# A stage's output only needs rebuilding when it is missing or older than its input. The
+	# input's mtime comes from the DirEntry's cached stat, so only the output is stat'ed here.
+	try:
+		return os.stat(dst).st_mtime >= src_entry.stat().st_mtime
+	except FileNotFoundError:
+		return False
+
+
+def gdal_worker_resources(job_count):
+	# Split the cores, and a quarter of RAM for the warp buffer plus block cache, evenly between
+	# the charts processed at once. Memory is given in MB, which every GDAL version understands.
+	workers = max(1, min(CPU_COUNT, job_count))
+	threads = str(max(1, CPU_COUNT // workers))
+	memory_mb = str(max(1, TOTAL_MEMORY_MB // 4 // 2 // workers))
+	return threads, memory_mb
 
-		# Remove TIFF files in processing directories. This is a fundamental part in the  mechanism to resume procssing after a halted run.
-		run_command('rm -f ' + os.path.join(raw_charts_directory, sectional_info['location'] + '.tif'))
-		run_command('rm -f ' + os.path.join(colored_charts_directory, sectional_info['location'] + '.tif'))
-		run_command('rm -f ' + os.path.join(cropped_charts_directory, sectional_info['location'] + '.tif'))
-		run_command('rm -f ' + os.path.join(warped_charts_directory, sectional_info['location'] + '.tif'))
 
-		# Download the individual chart
-		download_chart(sectional_info)
+def remove_tmp_files(directory):
+	# Remove any per-worker tmp files left behind by a halted run
+	for tmp_file in glob.glob(os.path.join(directory, 'tmp_*.tif')):
+		os.remove(tmp_file)
 
-		# Write the sectional information to the index file
-		set_local_sectional_version(sectional_info['location'], sectional_info['version'])
 
-		# Unzip the sectional and delete the original zip file
-		unzip_archive(os.path.join(raw_charts_directory, sectional_info['location'] + '.zip'), sectional_info['location'] + '.tif')
+def tmp_file_name():
+	# Each worker process gets its own tmp file so parallel runs don't clobber each other
+	return 'tmp_' + str(os.getpid()) + '.tif'
+
+
+def _expand_one(filename, threads):
+	tmp_file = colored_charts_directory + tmp_file_name()
+
+	proc = run_command(
+		['gdal_translate',
+		 '-expand', 'rgba',
+		 '--config', 'GDAL_NUM_THREADS', threads,
+		 '-of', 'GTiff',
+		 '-co', 'NUM_THREADS=' + threads] +
+		GTIFF_CREATION_OPTIONS +
+		[raw_charts_directory + filename,
+		 tmp_file]
+	)
+
+	# Don't install a missing or partial output; leave the chart for the next run to retry
+	if proc.returncode != 0:
+		silentremove(tmp_file)
+		return
+
+	# Move the temp file to its final location
+	os.replace(tmp_file, colored_charts_directory + filename)
+
+	print('    Expanded colors for ' + os.path.splitext(filename)[0])
 
 
 def expand_colors():
 	print('Expanding chart colors to RGBA...')
 
 	# Remove any tmp files which might already be present
-	run_command(
-		'rm ' + \
-		' ' + os.path.join(colored_charts_directory, 'tmp.tif')
+	remove_tmp_files(colored_charts_directory)
+
+	files = [entry.name for entry in chart_entries(raw_charts_directory)
+	         if not _up_to_date(entry, colored_charts_directory + entry.name)]
+
+	threads, _ = gdal_worker_resources(len(files))
+
+	with ProcessPoolExecutor(max_workers=CPU_COUNT) as ex:
+		list(ex.map(_expand_one, files, [threads] * len(files)))
+
+
+def _crop_and_warp_one(filename, shp, threads, memory_mb):
+	tmp_file = warped_charts_directory + tmp_file_name()
+
+	proc = run_command(
+		['gdalwarp',
+		 '-q',
+		 '-dstnodata', '0',
+		 '-cutline', clipping_shapes_directory + shp + '.shp',
+		 '-crop_to_cutline',
+		 '-cblend', '10',
+		 '-r', RESAMPLING,
+		 '-t_srs', 'EPSG:3857',
+		 '-multi',
+		 '-wo', 'NUM_THREADS=' + threads,
+		 '-wm', memory_mb,
+		 '--config', 'GDAL_CACHEMAX', memory_mb,
+		 '--config', 'GDAL_NUM_THREADS', threads,
+		 '-of', 'GTiff',
+		 '-co', 'NUM_THREADS=' + threads] +
+		GTIFF_CREATION_OPTIONS +
+		[colored_charts_directory + filename,
+		 tmp_file]
 	)
 
-	for filename in os.listdir(raw_charts_directory):
-		if filename.endswith('.tif') and not os.path.exists(os.path.join(colored_charts_directory, filename)):
-			run_command(
-				'gdal_translate' + \
-				' -expand rgba' + \
-				' -of GTiff' + \
-				' ' + os.path.join(raw_charts_directory, filename) + \
-				' ' + os.path.join(colored_charts_directory, 'tmp.tif')
-			)
-
-			# Move the temp file to its final location
-			run_command(
-				'mv ' + \
-				' ' + os.path.join(colored_charts_directory, 'tmp.tif') + \
-				' ' + os.path.join(colored_charts_directory, filename)
-			)
-
-			print('    Expanded colors for ' + os.path.splitext(filename)[0])
-
-def crop_charts():
-	print('Cropping charts to remove legend and border...')
-
-      # Remove any tmp files which might already be present
-	run_command(
-		'rm ' + \
-		' ' + os.path.join(cropped_charts_directory, 'tmp.tif')
-	)
+	# Don't install a missing or partial output; leave the chart for the next run to retry
+	if proc.returncode != 0:
+		silentremove(tmp_file)
+		return
+
+	# Move the temp file to its final location
+	os.replace(tmp_file, warped_charts_directory + shp + '.tif')
+
+	print('    Cropped and warped ' + shp)
+
+
+def remove_stale_warped_charts():
+	# Older versions of this script warped to EPSG:4326. BuildVRT skips sources whose projection
+	# differs from the first one, so those would silently drop out of the mosaic next to EPSG:3857
+	# charts. Remove them (and anything unreadable) so they get rebuilt.
+	for entry in chart_entries(warped_charts_directory):
+		dataset = gdal.Open(entry.path)
+		srs = dataset.GetSpatialRef() if dataset is not None else None
+		if srs is None or srs.IsGeographic():
+			print('    Removing outdated ' + os.path.splitext(entry.name)[0])
+			silentremove(entry.path)
+		dataset = None
+
+
+def crop_and_warp_charts():
+	print('Cropping charts to remove legend and border, and warping...')
 
-	for filename in os.listdir(colored_charts_directory):
-		if filename.endswith('.tif'):
-			# Handle the Western Aleutian Islands a little differently because they cross the +-180 longitude line
-			if 'Western_Aleutian_Islands' in filename and not os.path.exists(os.path.join(cropped_charts_directory, 'Western_Aleutian_Islands_East.tif')) and not os.path.exists(os.path.join(cropped_charts_directory, 'Western_Aleutian_Islands_West.tif')):
-				run_command(
-					'gdalwarp' + \
-					' -dstnodata 0' + \
-					' -q' + \
-					' -cutline ' + os.path.join(clipping_shapes_directory, 'Western_Aleutian_Islands_East.shp') + \
-					' -crop_to_cutline' + \
-					' -of GTiff' + \
-					' ' + os.path.join(colored_charts_directory, filename) + \
-					' ' + os.path.join(cropped_charts_directory, 'Western_Aleutian_Islands_East.tif')
-				)
-				print('    Cropped Western_Aleutian_Islands_East')
-				run_command(
-					'gdalwarp' + \
-					' -dstnodata 0' + \
-					' -q' + \
-					' -cutline ' + os.path.join(clipping_shapes_directory, 'Western_Aleutian_Islands_West.shp') + \
-					' -crop_to_cutline' + \
-					' -of GTiff' + \
-					' ' + os.path.join(colored_charts_directory, filename) + \
-					' ' + os.path.join(cropped_charts_directory, 'Western_Aleutian_Islands_West.tif')
-				)
-				print('    Cropped Western_Aleutian_Islands_West')
-			elif 'Western_Aleutian_Islands' not in filename and not os.path.exists(os.path.join(cropped_charts_directory, filename)):
-				run_command(
-					'gdalwarp' + \
-					' -dstnodata 0' + \
-					' -q' + \
-					' -cutline ' + os.path.join(clipping_shapes_directory, os.path.splitext(filename)[0] + '.shp') + \
-					' -crop_to_cutline' + \
-					' -of GTiff' + \
-					' ' + os.path.join(colored_charts_directory, filename) + \
-					' ' + os.path.join(cropped_charts_directory, 'tmp.tif')
-				)
-
-				# Move the temp file to its final location
-				run_command(
-					'mv ' + \
-					' ' + os.path.join(cropped_charts_directory, 'tmp.tif') + \
-					' ' + os.path.join(cropped_charts_directory, filename)
-				)
-
-				print('    Cropped ' + os.path.splitext(filename)[0])
-
-
-def warp_charts():
 	# Remove any tmp files which might already be present
-	run_command(
-		'rm ' + \
-		' ' + os.path.join(warped_charts_directory, 'tmp.tif')
-	)
+	remove_tmp_files(warped_charts_directory)
+	remove_stale_warped_charts()
+
+	filenames = list()
+	shps = list()
+	for entry in chart_entries(colored_charts_directory):
+		# Handle the Western Aleutian Islands a little differently because they cross the +-180 longitude line
+		if 'Western_Aleutian_Islands' in entry.name:
+			chart_shps = ['Western_Aleutian_Islands_East', 'Western_Aleutian_Islands_West']
+		else:
+			chart_shps = [os.path.splitext(entry.name)[0]]
 
-	print('Warping charts...')
-	for filename in os.listdir(cropped_charts_directory):
-		if filename.endswith('.tif') and not os.path.exists(os.path.join(warped_charts_directory, filename)):
-			run_command(
-				'gdalwarp' + \
-				' -r lanczos' + \
-				' -t_srs EPSG:4326' + \
-				' ' + os.path.join(cropped_charts_directory, filename) + \
-				' ' + os.path.join(warped_charts_directory, 'tmp.tif')
-			)
+		for shp in chart_shps:
+			if not _up_to_date(entry, warped_charts_directory + shp + '.tif'):
+				filenames.append(entry.name)
+				shps.append(shp)
 
-			# Move the temp file to its final location
-			run_command(
-				'mv ' + \
-				' ' + os.path.join(warped_charts_directory, 'tmp.tif') + \
-				' ' + os.path.join(warped_charts_directory, filename)
-			)
+	threads, memory_mb = gdal_worker_resources(len(filenames))
 
-			print('    Warped ' + os.path.splitext(filename)[0])
+	with ProcessPoolExecutor(max_workers=CPU_COUNT) as ex:
+		list(ex.map(_crop_and_warp_one, filenames, shps, [threads] * len(filenames), [memory_mb] * len(filenames)))
+
+
+class TileSizeQueryGDAL2Tiles(g2t.GDAL2Tiles):
+	# By default gdal2tiles reads a window 4x the tile size and resamples it down. With the query
+	# window equal to the tile size gdal2tiles skips that resampling and writes what ReadRaster
+	# returns, so base tiles become nearest-neighbour. Only used when FAST_BASE_TILES is set.
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.querysize = self.tile_size
 
 
 def create_leaflet_map_tiles():
 	print('Creating map tiles...')
 
 	# Remove any old map tiles
-	run_command('rm -rf ' + os.path.join(tiles_directory, '!(example.html)'))
-	run_command('rm -rf ' + os.path.join(intermediate_tiles_directory, '*'))
+	with os.scandir(tiles_directory) as entries:
+		for entry in entries:
+			if entry.name != 'example.html':
+				if entry.is_dir():
+					shutil.rmtree(entry.path, ignore_errors=True)
+				else:
+					silentremove(entry.path)
+	shutil.rmtree(intermediate_tiles_directory, ignore_errors=True)
 
 	# Create VRT file
-	run_command('rm -f ' + vrt_file)
-	run_command(
-		'gdalbuildvrt' + \
-		' ' + vrt_file + \
-		' ' + os.path.join(warped_charts_directory, '*.tif')
-	)
-
-	# Create map tiles
-      # Create map tiles
-	run_command(
-		'gdal2tiles.py ' + \
-		' --profile=mercator' + \
-		' -x' + \
-		' -r ' + RESAMPLING  + \
-		' --xyz' + \
-		' --zoom=' + str(MIN_ZOOM)  + '-' + str(MAX_ZOOM) + \
-		' ' + vrt_file + \
-            ' ' + intermediate_tiles_directory, True
+	silentremove(vrt_file)
+	vrt = gdal.BuildVRT(
+		vrt_file,
+		sorted(glob.glob(warped_charts_directory + '*.tif')),
+		options=gdal.BuildVRTOptions(resolution='highest')
 	)
+	# Closing the dataset flushes the VRT to disk
+	vrt = None
+
+	# Create map tiles in-process, letting gdal2tiles drive its own worker pool. gdal2tiles looks
+	# GDAL2Tiles up on its module when it plans the base tiles in this process, so for
+	# FAST_BASE_TILES the variant with the smaller query window is patched onto the module for the
+	# duration of the call and the original is put back afterwards.
+	original_gdal2tiles = g2t.GDAL2Tiles
+	if FAST_BASE_TILES:
+		g2t.GDAL2Tiles = TileSizeQueryGDAL2Tiles
+	try:
+		g2t.main(
+			['gdal2tiles',
+			 '--profile=mercator',
+			 '-x',
+			 '-r', RESAMPLING,
+			 '--xyz',
+			 '--zoom=%d-%d' % (MIN_ZOOM, MAX_ZOOM),
+			 '--processes=' + str(CPU_COUNT),
+			 vrt_file,
+			 intermediate_tiles_directory]
+		)
+	finally:
+		g2t.GDAL2Tiles = original_gdal2tiles
 
 	# Move created map tiles to tiles directory
 	for zoom_level in range(MIN_ZOOM, MAX_ZOOM + 1):
-		run_command(
-			'cp -R' + \
-			' ' + os.path.join(intermediate_tiles_directory, os.path.splitext(os.path.basename(vrt_file))[0] + '.tms/' + str(zoom_level)) + \
-			' ' + tiles_directory
+		shutil.copytree(
+			os.path.join(intermediate_tiles_directory, str(zoom_level)),
+			tiles_directory + str(zoom_level),
+			dirs_exist_ok=True
 		)
 
 
@@ -313,8 +413,7 @@ def main():
 	create_directories()
 	download_sectional_charts()
 	expand_colors()
-	crop_charts()
-	warp_charts()
+	crop_and_warp_charts()
 	create_leaflet_map_tiles()
 	
 